@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Database size and insert rate of historical states with per-point
+attributes (last_reset on each state) vs stable attributes.
+
+Home Assistant is not required, the recorder tables are reproduced over
+sqlite with both of its layouts:
+- "per-row": attributes stored in states.attributes for every row, as in
+  Home Assistant up to 2022.3 (including the 2021.11 pinned in Pipfile.lock).
+  Stable attributes only save the bytes of a shorter attributes string.
+- "shared": states.attributes_id pointing to state_attributes rows
+  deduplicated by hash of the serialized attributes, Home Assistant 2022.4
+  or newer. This is where stable attributes pay off.
+
+Figures are for this model of the recorder, not for the recorder itself.
+
+Usage: python benchmarks/bench_attributes.py [--days 30] [--step 120]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+SCHEMA_PER_ROW = """
+CREATE TABLE states (
+    state_id INTEGER PRIMARY KEY,
+    entity_id VARCHAR(255),
+    state VARCHAR(255),
+    attributes TEXT,
+    last_changed DATETIME,
+    last_updated DATETIME,
+    old_state_id INTEGER
+);
+CREATE INDEX ix_states_entity_id_last_updated ON states (
+    entity_id, last_updated
+);
+"""
+
+SCHEMA_SHARED = """
+CREATE TABLE state_attributes (
+    attributes_id INTEGER PRIMARY KEY,
+    hash BIGINT,
+    shared_attrs TEXT
+);
+CREATE INDEX ix_state_attributes_hash ON state_attributes (hash);
+CREATE TABLE states (
+    state_id INTEGER PRIMARY KEY,
+    entity_id VARCHAR(255),
+    state VARCHAR(255),
+    last_changed DATETIME,
+    last_updated DATETIME,
+    old_state_id INTEGER,
+    attributes_id INTEGER
+);
+CREATE INDEX ix_states_entity_id_last_updated ON states (
+    entity_id, last_updated
+);
+CREATE INDEX ix_states_attributes_id ON states (attributes_id);
+"""
+
+ENTITY_ID = "sensor.mcfly"
+BASE_ATTRIBUTES = {
+    "state_class": "measurement",
+    "unit_of_measurement": "kWh",
+    "friendly_name": "mcfly",
+    "device_class": "energy",
+}
+COMMIT_EVERY = 100
+
+
+def generate(days, step, stable):
+    end = datetime(2021, 12, 1, tzinfo=timezone.utc)
+    start = end - timedelta(days=days)
+    n_points = int((end - start) / step)
+
+    for x in range(n_points):
+        p1 = start + step * x
+        p2 = p1 + step
+
+        attrs = dict(BASE_ATTRIBUTES)
+        if stable:
+            attrs["last_reset"] = None
+            attrs["interval"] = int(step.total_seconds())
+        else:
+            attrs["last_reset"] = p1.isoformat()
+
+        yield p2, f"{(x % 97) / 10:.1f}", attrs
+
+
+def run(path, days, step, stable, shared):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA_SHARED if shared else SCHEMA_PER_ROW)
+
+    attributes_ids = {}
+    old_state_id = None
+    n_points = 0
+
+    t0 = time.perf_counter()
+    for n_points, (dt, state, attrs) in enumerate(
+        generate(days, step, stable), start=1
+    ):
+        attrs_json = json.dumps(attrs, separators=(",", ":"))
+
+        if shared:
+            if (attributes_id := attributes_ids.get(attrs_json)) is None:
+                cur = conn.execute(
+                    "INSERT INTO state_attributes (hash, shared_attrs) "
+                    "VALUES (?, ?)",
+                    (zlib.crc32(attrs_json.encode()), attrs_json),
+                )
+                attributes_id = attributes_ids[attrs_json] = cur.lastrowid
+
+            cur = conn.execute(
+                "INSERT INTO states (entity_id, state, last_changed, "
+                "last_updated, old_state_id, attributes_id) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (ENTITY_ID, state, dt, dt, old_state_id, attributes_id),
+            )
+
+        else:
+            cur = conn.execute(
+                "INSERT INTO states (entity_id, state, attributes, "
+                "last_changed, last_updated, old_state_id) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (ENTITY_ID, state, attrs_json, dt, dt, old_state_id),
+            )
+
+        old_state_id = cur.lastrowid
+
+        if n_points % COMMIT_EVERY == 0:
+            conn.commit()
+
+    conn.commit()
+    elapsed = time.perf_counter() - t0
+
+    (n_attributes,) = conn.execute(
+        "SELECT COUNT(*) FROM state_attributes"
+        if shared
+        else "SELECT COUNT(DISTINCT attributes) FROM states"
+    ).fetchone()
+    conn.close()
+
+    return {
+        "points": n_points,
+        "attribute_sets": n_attributes,
+        "size_kib": os.path.getsize(path) / 1024,
+        "rate": n_points / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--step", type=int, default=120, help="seconds")
+    args = parser.parse_args()
+
+    step = timedelta(seconds=args.step)
+    print(f"{args.days} days of data, one point every {args.step}s")
+    print(
+        f"{'recorder':<9} {'mode':<10} {'points':>8} {'attr sets':>10} "
+        f"{'size (KiB)':>11} {'inserts/s':>10}"
+    )
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for schema, shared in (("per-row", False), ("shared", True)):
+            for mode, stable in (("per-point", False), ("stable", True)):
+                res = run(
+                    os.path.join(tmpdir, f"{schema}-{mode}.db"),
+                    args.days,
+                    step,
+                    stable,
+                    shared,
+                )
+                print(
+                    f"{schema:<9} {mode:<10} {res['points']:>8} "
+                    f"{res['attribute_sets']:>10} "
+                    f"{res['size_kib']:>11.0f} {res['rate']:>10.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -23,25 +23,43 @@ from __future__ import annotations
 import logging
 from datetime import timedelta
 
+import voluptuous as vol
+from homeassistant.components import websocket_api
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers import config_validation as cv
+from homeassistant.util import dt as dt_util
 
 from .api import API
-from .const import DOMAIN
+from .const import DATA_HISTORICAL_ENTITIES, DOMAIN
 
 SCAN_INTERVAL = timedelta(seconds=10)
 PLATFORMS: list[str] = ["sensor"]
 _LOGGER = logging.getLogger(__name__)
 
 
+async def async_setup(hass: HomeAssistant, config: dict) -> bool:
+    websocket_api.async_register_command(hass, ws_value_at)
+    websocket_api.async_register_command(hass, ws_sum)
+
+    return True
+
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     hass.data[DOMAIN] = hass.data.get(DOMAIN, {})
     hass.data[DOMAIN][entry.entry_id] = API()
     hass.config_entries.async_setup_platforms(entry, PLATFORMS)
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
 
     return True
 
 
+async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload config entry when options change."""
+
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
 
@@ -53,3 +71,59 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         hass.data[DOMAIN].pop(entry.entry_id)
 
     return unload_ok
+
+
+def _get_historical_entity(hass, connection, msg):
+    entity = hass.data.get(DATA_HISTORICAL_ENTITIES, {}).get(msg["entity_id"])
+    if entity is None:
+        connection.send_error(
+            msg["id"],
+            websocket_api.const.ERR_NOT_FOUND,
+            f"{msg['entity_id']} is not a historical entity",
+        )
+
+    return entity
+
+
+@websocket_api.websocket_command(
+    {
+        vol.Required("type"): f"{DOMAIN}/value_at",
+        vol.Required("entity_id"): cv.entity_id,
+        vol.Required("time"): cv.datetime,
+    }
+)
+@websocket_api.async_response
+async def ws_value_at(hass, connection, msg):
+    """Value of an historical entity at some point in time"""
+
+    if (entity := _get_historical_entity(hass, connection, msg)) is None:
+        return
+
+    ret = await entity.async_historical_value_at(dt_util.as_utc(msg["time"]))
+    if ret is None:
+        connection.send_result(msg["id"], None)
+        return
+
+    dt, value = ret
+    connection.send_result(msg["id"], {"time": dt, "value": value})
+
+
+@websocket_api.websocket_command(
+    {
+        vol.Required("type"): f"{DOMAIN}/sum",
+        vol.Required("entity_id"): cv.entity_id,
+        vol.Required("start"): cv.datetime,
+        vol.Required("end"): cv.datetime,
+    }
+)
+@websocket_api.async_response
+async def ws_sum(hass, connection, msg):
+    """Sum of the values of an historical entity in [start, end)"""
+
+    if (entity := _get_historical_entity(hass, connection, msg)) is None:
+        return
+
+    ret = await entity.async_historical_sum(
+        dt_util.as_utc(msg["start"]), dt_util.as_utc(msg["end"])
+    )
+    connection.send_result(msg["id"], {"sum": ret})
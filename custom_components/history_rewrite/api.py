@@ -32,12 +32,9 @@ class API:
 
     @staticmethod
     def calculate_value(point, aprox):
-        rstate = random.getstate()
-        random.seed(point)
-        ret = aprox * random.randint(75, 100) / 100
-        random.setstate(rstate)
-
-        return ret
+        # Local generator, the global one is not safe to reseed from executor
+        # threads
+        return aprox * random.Random(point).randint(75, 100) / 100
 
     def get_historical_data(self, start=None, end=None, step=None):
         return list(self._get_historical_data(start, end, step))
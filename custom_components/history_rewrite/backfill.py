@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+import math
+import time
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Iterable, Iterator, Optional
+
+from homeassistant.util import dt as dt_util
+
+_LOGGER = logging.getLogger(__name__)
+
+STATUS_RUNNING = "running"
+STATUS_PAUSED = "paused"
+STATUS_DONE = "done"
+STATUS_CANCELLED = "cancelled"
+STATUS_FAILED = "failed"
+
+DEFAULT_CHUNK_SIZE = 720
+DEFAULT_CONCURRENCY = 4
+
+
+def split_range(
+    start: datetime, end: datetime, step: timedelta, chunk_size: int
+) -> Iterator[tuple[datetime, datetime]]:
+    """Split [start, end) in chunks of (up to) chunk_size steps"""
+
+    span = step * chunk_size
+    curr = start
+    while curr < end:
+        nxt = min(curr + span, end)
+        yield curr, nxt
+        curr = nxt
+
+
+async def async_fetch_in_order(
+    entity: Any,
+    chunks: Iterable[tuple[datetime, datetime]],
+    step: timedelta,
+    concurrency: int,
+) -> AsyncIterator[tuple[datetime, list]]:
+    """Fetch chunks with entity.async_fetch_historical_log, with up to
+    concurrency fetches in flight, and yield (chunk end, log) in order.
+
+    Next chunks are only fetched as the consumer advances, so memory usage
+    is bounded by concurrency, not by the number of chunks.
+    """
+
+    chunks = iter(chunks)
+    pending: collections.deque[tuple[datetime, asyncio.Task]] = (
+        collections.deque()
+    )
+
+    def _schedule() -> None:
+        if (chunk := next(chunks, None)) is None:
+            return
+
+        start, end = chunk
+        task = entity.hass.async_create_task(
+            entity.async_fetch_historical_log(start, end, step)
+        )
+        pending.append((end, task))
+
+    try:
+        for _ in range(concurrency):
+            _schedule()
+
+        while pending:
+            chunk_end, task = pending.popleft()
+            log = await task
+            _schedule()
+            yield chunk_end, log
+
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+
+class Backfill:
+    """Managed backfill of a HistoricalEntity between start and end.
+
+    The range is split in chunks of `chunk_size` points. Up to `concurrency`
+    chunks are fetched at the same time but they are always written in order.
+    After each chunk the position is handed back to the entity so it can be
+    persisted and the job resumed after a restart.
+
+    The entity must implement:
+    - async_fetch_historical_log(start, end, step)
+    - async_write_historical_chunk(log)
+    - async_backfill_updated(backfill)
+    """
+
+    def __init__(
+        self,
+        entity: Any,
+        start: datetime,
+        end: datetime,
+        step: timedelta,
+        position: Optional[datetime] = None,
+        status: str = STATUS_RUNNING,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+    ):
+        self.entity = entity
+        self.start = start
+        self.end = end
+        self.step = step
+        self.position = position or start
+        self.status = status
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+
+        self._task: Optional[asyncio.Task] = None
+        self._resumed = asyncio.Event()
+        if self.status == STATUS_RUNNING:
+            self._resumed.set()
+
+        # (monotonic time, position) used to calculate rate and ETA
+        self._rate_origin: Optional[tuple[float, datetime]] = None
+
+    @classmethod
+    def from_dict(cls, entity: Any, data: dict[str, Any]) -> Backfill:
+        return cls(
+            entity,
+            start=dt_util.utc_from_timestamp(data["start"]),
+            end=dt_util.utc_from_timestamp(data["end"]),
+            step=timedelta(seconds=data["step"]),
+            position=dt_util.utc_from_timestamp(data["position"]),
+            status=data["status"],
+            chunk_size=data["chunk_size"],
+            concurrency=data["concurrency"],
+        )
+
+    def as_dict(self) -> dict[str, Any]:
+        """Serializable representation, suitable for a Store"""
+
+        return {
+            "start": self.start.timestamp(),
+            "end": self.end.timestamp(),
+            "step": self.step.total_seconds(),
+            "position": self.position.timestamp(),
+            "status": self.status,
+            "chunk_size": self.chunk_size,
+            "concurrency": self.concurrency,
+        }
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (STATUS_RUNNING, STATUS_PAUSED)
+
+    @property
+    def total(self) -> int:
+        return math.ceil((self.end - self.start) / self.step)
+
+    @property
+    def done(self) -> int:
+        return int((self.position - self.start) / self.step)
+
+    @property
+    def progress(self) -> float:
+        if not self.total:
+            return 100.0
+
+        return round(100 * self.done / self.total, 1)
+
+    @property
+    def rate(self) -> Optional[float]:
+        """Points per second since the job was (re)started"""
+
+        if self.status != STATUS_RUNNING or not self._rate_origin:
+            return None
+
+        t0, p0 = self._rate_origin
+        elapsed = time.monotonic() - t0
+        if not elapsed:
+            return None
+
+        return round(((self.position - p0) / self.step) / elapsed, 2)
+
+    @property
+    def eta(self) -> Optional[datetime]:
+        rate = self.rate
+        if not rate:
+            return None
+
+        remaining = (self.total - self.done) / rate
+        return dt_util.utcnow() + timedelta(seconds=remaining)
+
+    def async_start(self) -> None:
+        """Start (or resume after a restart) the job in the background"""
+
+        if self._task and not self._task.done():
+            return
+
+        self._task = self.entity.hass.async_create_task(self._async_run())
+
+    def pause(self) -> None:
+        """Stop writing after the current chunk. Fetches in flight finish"""
+
+        if self.status != STATUS_RUNNING:
+            return
+
+        self.status = STATUS_PAUSED
+        self._resumed.clear()
+        self._rate_origin = None
+
+    def resume(self) -> None:
+        if self.status != STATUS_PAUSED:
+            return
+
+        self.status = STATUS_RUNNING
+        self._resumed.set()
+
+    async def async_cancel(self) -> None:
+        if not self.is_active:
+            return
+
+        self.stop()
+        self.status = STATUS_CANCELLED
+        await self.entity.async_backfill_updated(self)
+
+    def stop(self) -> None:
+        """Stop the background task without touching the persisted status, ex.
+        when the entity is removed from hass.
+        """
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+        self._task = None
+
+    async def _async_run(self) -> None:
+        fetched = async_fetch_in_order(
+            self.entity,
+            split_range(self.position, self.end, self.step, self.chunk_size),
+            self.step,
+            self.concurrency,
+        )
+
+        _LOGGER.debug(
+            f"Backfill {self.entity.entity_id}: "
+            f"{self.position} → {self.end} ({self.total - self.done} points)"
+        )
+
+        try:
+            await self._resumed.wait()
+            self._rate_origin = (time.monotonic(), self.position)
+
+            async for chunk_end, log in fetched:
+                if not self._resumed.is_set():
+                    await self.entity.async_backfill_updated(self)
+                    await self._resumed.wait()
+                    self._rate_origin = (time.monotonic(), self.position)
+
+                await self.entity.async_write_historical_chunk(log)
+                self.position = chunk_end
+                await self.entity.async_backfill_updated(self)
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception:
+            _LOGGER.exception(f"Backfill {self.entity.entity_id} failed")
+            self.status = STATUS_FAILED
+            await self.entity.async_backfill_updated(self)
+            return
+
+        finally:
+            await fetched.aclose()
+
+        self.status = STATUS_DONE
+        await self.entity.async_backfill_updated(self)
+        _LOGGER.debug(f"Backfill {self.entity.entity_id} done")
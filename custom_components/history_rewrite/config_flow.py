@@ -22,10 +22,11 @@ from typing import Any, Optional
 
 import voluptuous as vol
 from homeassistant import config_entries
+from homeassistant.core import callback
 from homeassistant.data_entry_flow import FlowResult
 
 from .api import API
-from .const import DOMAIN
+from .const import CONF_STABLE_ATTRIBUTES, DOMAIN
 
 STEP_USER_DATA_SCHEMA = vol.Schema({})
 
@@ -52,3 +53,33 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
         api = API()
         return self.async_create_entry(title=api.device_info["name"], data={})
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return OptionsFlowHandler(config_entry)
+
+
+class OptionsFlowHandler(config_entries.OptionsFlow):
+    def __init__(self, config_entry):
+        self.config_entry = config_entry
+
+    async def async_step_init(
+        self, user_input: Optional[dict[str, Any]] = None
+    ) -> FlowResult:
+        """Manage the options."""
+
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        schema = vol.Schema(
+            {
+                vol.Optional(
+                    CONF_STABLE_ATTRIBUTES,
+                    default=self.config_entry.options.get(
+                        CONF_STABLE_ATTRIBUTES, False
+                    ),
+                ): bool,
+            }
+        )
+        return self.async_show_form(step_id="init", data_schema=schema)
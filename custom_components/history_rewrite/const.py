@@ -20,3 +20,26 @@
 
 DOMAIN = "history_rewrite"
 DEFAULT_SENSOR_NAME = "mcfly"
+
+CONF_STABLE_ATTRIBUTES = "stable_attributes"
+
+SERVICE_BACKFILL = "backfill"
+SERVICE_BACKFILL_PAUSE = "backfill_pause"
+SERVICE_BACKFILL_RESUME = "backfill_resume"
+SERVICE_BACKFILL_CANCEL = "backfill_cancel"
+SERVICE_REPAIR = "repair"
+SERVICE_EXPORT = "export"
+SERVICE_PROFILE = "profile"
+
+ATTR_START = "start"
+ATTR_END = "end"
+ATTR_CHUNK_SIZE = "chunk_size"
+ATTR_CONCURRENCY = "concurrency"
+ATTR_FILENAME = "filename"
+ATTR_FORMAT = "format"
+ATTR_CYCLES = "cycles"
+ATTR_INTERVAL = "interval"
+
+SIGNAL_BACKFILL_UPDATED = DOMAIN + "_backfill_updated_{}"
+
+DATA_HISTORICAL_ENTITIES = DOMAIN + "_entities"
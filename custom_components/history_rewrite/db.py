@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Direct (read only) queries to the recorder database.
+
+All functions are blocking, they must be run in the executor.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Iterator, Optional
+
+from homeassistant.components.recorder.models import States, process_timestamp
+from homeassistant.components.recorder.util import session_scope
+from homeassistant.core import HomeAssistant
+
+
+def get_states(
+    hass: HomeAssistant, entity_id: str, start: datetime, end: datetime
+) -> list[tuple[datetime, str]]:
+    """Ordered (time, state) rows of entity_id in [start, end)"""
+
+    with session_scope(hass=hass) as session:
+        query = (
+            session.query(States.last_updated, States.state)
+            .filter(States.entity_id == entity_id)
+            .filter(States.last_updated >= start)
+            .filter(States.last_updated < end)
+            .order_by(States.last_updated)
+        )
+        return [(process_timestamp(dt), state) for (dt, state) in query]
+
+
+def get_state_at(
+    hass: HomeAssistant, entity_id: str, dt: datetime
+) -> Optional[tuple[datetime, str]]:
+    """Last (time, state) row of entity_id at or before dt"""
+
+    with session_scope(hass=hass) as session:
+        row = (
+            session.query(States.last_updated, States.state)
+            .filter(States.entity_id == entity_id)
+            .filter(States.last_updated <= dt)
+            .order_by(States.last_updated.desc())
+            .limit(1)
+            .one_or_none()
+        )
+        if row is None:
+            return None
+
+        return process_timestamp(row[0]), row[1]
+
+
+def get_state_times(
+    hass: HomeAssistant, entity_id: str, start: datetime, end: datetime
+) -> list[float]:
+    """Ordered timestamps of the state rows of entity_id in [start, end].
+
+    Only the last_updated column is fetched so the query is answered from
+    the (entity_id, last_updated) index.
+    """
+
+    with session_scope(hass=hass) as session:
+        query = (
+            session.query(States.last_updated)
+            .filter(States.entity_id == entity_id)
+            .filter(States.last_updated >= start)
+            .filter(States.last_updated <= end)
+            .order_by(States.last_updated)
+        )
+        return [process_timestamp(dt).timestamp() for (dt,) in query]
+
+
+def iter_state_batches(
+    hass: HomeAssistant,
+    entity_id: str,
+    start: datetime,
+    end: datetime,
+    batch_size: int,
+) -> Iterator[list[tuple[datetime, str]]]:
+    """Ordered (time, state) rows of entity_id in [start, end) in batches of
+    batch_size rows.
+
+    Rows are streamed with a server-side cursor so memory usage doesn't
+    depend on the size of the range. Times are naive UTC datetimes, as
+    stored by the recorder.
+    """
+
+    with session_scope(hass=hass) as session:
+        query = (
+            session.query(States.last_updated, States.state)
+            .filter(States.entity_id == entity_id)
+            .filter(States.last_updated >= start)
+            .filter(States.last_updated < end)
+            .order_by(States.last_updated)
+        )
+        result = (
+            session.connection()
+            .execution_options(stream_results=True)
+            .execute(query.statement)
+        )
+        yield from result.partitions(batch_size)
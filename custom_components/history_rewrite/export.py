@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Columnar (Arrow IPC / Parquet) export of the states of an entity.
+
+pyarrow is an optional dependency, it's only required to export.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from datetime import datetime
+
+from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import HomeAssistantError
+
+from . import db
+
+_LOGGER = logging.getLogger(__name__)
+
+FORMAT_ARROW = "arrow"
+FORMAT_PARQUET = "parquet"
+FORMATS = [FORMAT_ARROW, FORMAT_PARQUET]
+
+DEFAULT_BATCH_SIZE = 10_000
+
+
+def export_states(
+    hass: HomeAssistant,
+    entity_id: str,
+    start: datetime,
+    end: datetime,
+    path: str,
+    fmt: str = FORMAT_PARQUET,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """Stream the states of entity_id in [start, end) into path.
+    Returns the number of exported rows.
+
+    Blocking, must be run in the executor.
+    """
+
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise HomeAssistantError(
+            "pyarrow is required to export history (pip install pyarrow)"
+        ) from e
+
+    schema = pa.schema(
+        [
+            ("last_updated", pa.timestamp("us", tz="UTC")),
+            ("state", pa.string()),
+        ]
+    )
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if fmt == FORMAT_ARROW:
+        writer = pa.ipc.new_file(path, schema)
+    elif fmt == FORMAT_PARQUET:
+        writer = pa.parquet.ParquetWriter(path, schema)
+    else:
+        raise HomeAssistantError(f"Unknown export format: {fmt}")
+
+    n_rows = 0
+    with writer:
+        for rows in db.iter_state_batches(
+            hass, entity_id, start, end, batch_size
+        ):
+            times, states = zip(*rows)
+            batch = pa.RecordBatch.from_arrays(
+                [
+                    pa.array(times, type=schema.field("last_updated").type),
+                    pa.array(states, type=pa.string()),
+                ],
+                schema=schema,
+            )
+            writer.write_batch(batch)
+            n_rows += batch.num_rows
+
+    _LOGGER.debug(f"Exported {n_rows} states of {entity_id} to {path}")
+    return n_rows
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from __future__ import annotations
+
+import math
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from homeassistant.util import dt as dt_util
+
+
+def find_gaps(
+    times: Iterable[float], start: datetime, end: datetime, step: timedelta
+) -> list[tuple[datetime, datetime]]:
+    """Compare the timestamps of the stored states with the expected grid
+    and return the minimal list of (start, end) ranges to fetch again.
+
+    Each interval is stored at its end time, so the expected points are
+    start + step, start + 2 * step, ..., end. A stored state anywhere in
+    ((k - 1) * step, k * step] covers the k-th point, so history written
+    off-grid (ex. by older versions, aligned to the minute) isn't reported
+    as missing. Consecutive missing points are merged into a single range.
+
+    Ex. (step=1)
+    find_gaps([1, 2, 5], 0, 6, 1) -> [(2, 4), (5, 6)]
+    find_gaps([0.5, 1.5, 4.5], 0, 6, 1) -> [(2, 4), (5, 6)]
+    """
+
+    step_s = step.total_seconds()
+    start_ts = dt_util.as_utc(start).timestamp()
+    n_points = int((dt_util.as_utc(end).timestamp() - start_ts) // step_s)
+
+    # Round before ceil to absorb float noise of on-grid timestamps
+    present = {math.ceil(round((ts - start_ts) / step_s, 6)) for ts in times}
+
+    ret = []
+    gap_start = None
+    for k in range(1, n_points + 1):
+        if k in present:
+            if gap_start is not None:
+                ret.append((gap_start, k - 1))
+                gap_start = None
+
+        elif gap_start is None:
+            gap_start = k - 1
+
+    if gap_start is not None:
+        ret.append((gap_start, n_points))
+
+    return [(start + step * a, start + step * b) for (a, b) in ret]
@@ -18,24 +18,49 @@
 # USA.
 
 import logging
-from dataclasses import dataclass
+import os
+from bisect import bisect_right
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from typing import Any, Iterable, Optional, Mapping
 from homeassistant.core import MappingProxyType
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.dispatcher import async_dispatcher_send
 from homeassistant.helpers.entity import Entity
 from homeassistant.helpers.event import async_track_time_interval
 from homeassistant.helpers.storage import Store
 from homeassistant.util import dt as dt_util
 
+from . import db
+from .backfill import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_CONCURRENCY,
+    Backfill,
+    async_fetch_in_order,
+    split_range,
+)
+from .const import DATA_HISTORICAL_ENTITIES, DOMAIN, SIGNAL_BACKFILL_UPDATED
+from .export import FORMAT_PARQUET, export_states
+from .gaps import find_gaps
 from .hack import (
     _build_attributes,
     _stringify_state,
     async_set,
 )
+from .profiler import DEFAULT_CYCLES, Profiler
+from .time_index import TimeIndex
 
 _LOGGER = logging.getLogger(__name__)
 STORE_LAST_UPDATE = "last_update"
 STORE_LAST_STATE = "last_state"
+STORE_BACKFILL = "backfill"
+
+
+def floor_to_step(dt: datetime, step: timedelta) -> datetime:
+    """Align dt to the previous multiple of step (counting from epoch)"""
+
+    ts = dt_util.as_utc(dt).timestamp()
+    return dt_util.utc_from_timestamp(ts - ts % step.total_seconds())
 
 
 @dataclass
@@ -43,6 +68,10 @@ class HistoricalData:
     log: list[tuple[datetime, Any]]
     data: Mapping[str, Any]
     state: Store
+    backfill: Optional[Backfill] = None
+    index: TimeIndex = field(default_factory=TimeIndex)
+    profiler: Optional[Profiler] = None
+    repairing: bool = False
 
 
 class HistoricalEntity:
@@ -65,18 +94,47 @@ class HistoricalEntity:
 
         async def _execute_update(*args, **kwargs):
             _LOGGER.debug("Run update")
-            await self.async_update()
-            await self.flush_historical_log()
+
+            if (profiler := self.historical.profiler) is None:
+                await self.async_update()
+                await self.flush_historical_log()
+                return
+
+            profiler.start_cycle()
+            try:
+                await self.async_update()
+                await self.flush_historical_log()
+            finally:
+                await self._async_profiled_cycle_done(profiler)
 
         if not self.should_poll:
-            async_track_time_interval(
-                self.hass, _execute_update, timedelta(seconds=60 * 5)
+            self.async_on_remove(
+                async_track_time_interval(
+                    self.hass, _execute_update, timedelta(seconds=60 * 5)
+                )
             )
 
         self.historical.state = Store(
             hass=self.hass, version=1, key=self.entity_id
         )
         await self.load_state()
+        await self.async_warm_historical_index()
+
+        if backfill := self.historical.data[STORE_BACKFILL]:
+            self.historical.backfill = Backfill.from_dict(self, backfill)
+            if self.historical.backfill.is_active:
+                self.historical.backfill.async_start()
+
+        self.async_on_remove(self._stop_backfill)
+        self.async_on_remove(self._stop_profiler)
+
+        entities = self.hass.data.setdefault(DATA_HISTORICAL_ENTITIES, {})
+        entities[self.entity_id] = self
+
+        def _unregister():
+            entities.pop(self.entity_id, None)
+
+        self.async_on_remove(_unregister)
 
         await self.flush_historical_log()
 
@@ -89,6 +147,94 @@ class HistoricalEntity:
 
         return self.historical.data[STORE_LAST_STATE]
 
+    async def async_warm_historical_index(self) -> None:
+        """Load the retention window of the index from the recorder"""
+
+        index = self.historical.index
+        end = dt_util.utcnow()
+        start = end - index.retention
+
+        rows = await self.hass.async_add_executor_job(
+            db.get_states, self.hass, self.entity_id, start, end
+        )
+        index.load(start, rows)
+
+        _LOGGER.debug(f"Index warmed with {len(index)} points since {start}")
+
+    async def async_historical_value_at(
+        self, dt: datetime
+    ) -> Optional[tuple[datetime, float]]:
+        """Value (and its time) of the entity at dt.
+        Uses the in-memory index, falls back to the database for older data.
+        """
+
+        dt = dt_util.as_utc(dt)
+        if (ret := self.historical.index.value_at(dt)) is not None:
+            return ret
+
+        row = await self.hass.async_add_executor_job(
+            db.get_state_at, self.hass, self.entity_id, dt
+        )
+        if row is None:
+            return None
+
+        try:
+            return row[0], float(row[1])
+        except ValueError:
+            return None
+
+    async def async_historical_sum(
+        self, start: datetime, end: datetime
+    ) -> float:
+        """Sum of the values of the entity in [start, end).
+        Uses the in-memory index, falls back to the database for the range not
+        covered by it.
+        """
+
+        start = dt_util.as_utc(start)
+        end = dt_util.as_utc(end)
+
+        index = self.historical.index
+        if (ret := index.sum(start, end)) is not None:
+            return ret
+
+        since = index.since
+        db_end = min(end, since) if since else end
+
+        # Take the index part before querying the database, the index can be
+        # trimmed past db_end while waiting for it
+        ret = index.sum(db_end, end) if db_end < end else 0.0
+        if ret is None:
+            db_end, ret = end, 0.0
+
+        rows = await self.hass.async_add_executor_job(
+            db.get_states, self.hass, self.entity_id, start, db_end
+        )
+        for (_, state) in rows:
+            try:
+                ret += float(state)
+            except ValueError:
+                pass
+
+        return ret
+
+    @property
+    def historical_step(self) -> timedelta:
+        """Size of the intervals returned by async_fetch_historical_log"""
+
+        return timedelta(minutes=10)
+
+    async def async_fetch_historical_log(
+        self, start: datetime, end: datetime, step: timedelta
+    ) -> list[tuple[datetime, Any, Optional[Mapping]]]:
+        """Fetch historical states between start and end.
+        Returned data must be in the same format accepted by
+        extend_historical_log.
+
+        Entities must implement this method in order to support backfills.
+        """
+        raise NotImplementedError()
+
     def extend_historical_log(
         self, data: Iterable[tuple[datetime, Any, Optional[Mapping]]]
     ) -> None:
@@ -119,11 +265,7 @@ class HistoricalEntity:
             except IndexError:
                 break
 
-            if len(pack) == 2:
-                dt, value = pack
-                attributes = {}
-            else:
-                dt, value, attributes = pack
+            dt, value, attributes = self._unpack_historical_pack(pack)
 
             if dt <= self.historical.data[STORE_LAST_UPDATE]:
                 _LOGGER.debug(f"Skip update for {value} @ {dt}")
@@ -146,6 +288,255 @@ class HistoricalEntity:
                 {STORE_LAST_UPDATE: dt, STORE_LAST_STATE: value}
             )
 
+    async def async_write_historical_chunk(
+        self, log: Iterable[tuple[datetime, Any, Optional[Mapping]]]
+    ) -> None:
+        """Write an ordered chunk of historical states, bypassing the log.
+        Unlike flush_historical_log states older than the last update are
+        written too, this is used by backfills to fill the past.
+
+        Points whose interval (dt - step, dt] already has a state in the
+        database are skipped, so overlapping ranges don't duplicate rows.
+        """
+
+        log = [self._unpack_historical_pack(pack) for pack in log]
+        if not log:
+            return
+
+        step = self.historical_step
+        stored = await self.hass.async_add_executor_job(
+            db.get_state_times,
+            self.hass,
+            self.entity_id,
+            dt_util.as_utc(log[0][0] - step),
+            dt_util.as_utc(log[-1][0]),
+        )
+        step_s = step.total_seconds()
+
+        now = dt_util.now()
+        last = None
+        written = []
+
+        for dt, value, attributes in log:
+            if dt >= now:
+                _LOGGER.debug(f"Skip FUTURE for {value} @ {dt}")
+                continue
+
+            ts = dt_util.as_utc(dt).timestamp()
+            idx = bisect_right(stored, ts)
+            if idx and stored[idx - 1] > ts - step_s:
+                _LOGGER.debug(f"Skip STORED for {value} @ {dt}")
+                continue
+
+            state = self.write_state_at_time(
+                value, dt=dt, attributes=attributes, index=False
+            )
+            written.append((dt, state))
+            last = (dt, value)
+
+        # Chunks are usually older than the indexed data, add them in one
+        # batch so the prefix sum is rebuilt once
+        self.historical.index.add_many(written)
+
+        if last and last[0] > self.historical.data[STORE_LAST_UPDATE]:
+            await self.save_state(
+                {STORE_LAST_UPDATE: last[0], STORE_LAST_STATE: last[1]}
+            )
+
+    @staticmethod
+    def _unpack_historical_pack(pack):
+        if len(pack) == 2:
+            dt, value = pack
+            attributes = {}
+        else:
+            dt, value, attributes = pack
+
+        return dt, value, attributes
+
+    async def async_backfill(
+        self,
+        start: datetime,
+        end: Optional[datetime] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+    ) -> None:
+        """Start a managed backfill between start and end (or now)"""
+
+        if self.historical.backfill and self.historical.backfill.is_active:
+            raise HomeAssistantError(
+                f"{self.entity_id}: a backfill is already in progress"
+            )
+
+        if self.historical.repairing:
+            raise HomeAssistantError(
+                f"{self.entity_id}: a repair is in progress"
+            )
+
+        step = self.historical_step
+        start = floor_to_step(start, step)
+        end = floor_to_step(end or dt_util.now(), step)
+        if start >= end:
+            raise HomeAssistantError(f"Invalid backfill range {start}-{end}")
+
+        self.historical.backfill = Backfill(
+            self,
+            start=start,
+            end=end,
+            step=step,
+            chunk_size=chunk_size,
+            concurrency=concurrency,
+        )
+        await self.async_backfill_updated(self.historical.backfill)
+        self.historical.backfill.async_start()
+
+    async def async_backfill_pause(self) -> None:
+        if self.historical.backfill:
+            self.historical.backfill.pause()
+            await self.async_backfill_updated(self.historical.backfill)
+
+    async def async_backfill_resume(self) -> None:
+        if self.historical.backfill:
+            self.historical.backfill.resume()
+            await self.async_backfill_updated(self.historical.backfill)
+
+    async def async_backfill_cancel(self) -> None:
+        if self.historical.backfill:
+            await self.historical.backfill.async_cancel()
+
+    async def async_backfill_updated(self, backfill: Backfill) -> None:
+        """Persist backfill position and notify listeners"""
+
+        await self.save_state({STORE_BACKFILL: backfill.as_dict()})
+        async_dispatcher_send(
+            self.hass, SIGNAL_BACKFILL_UPDATED.format(self.unique_id)
+        )
+
+    async def async_find_historical_gaps(
+        self, start: datetime, end: Optional[datetime] = None
+    ) -> list[tuple[datetime, datetime]]:
+        """Ranges between start and end (or the last update) missing in the
+        database according to the historical_step grid.
+        """
+
+        step = self.historical_step
+        start = floor_to_step(start, step)
+        end = end or self.historical.data[STORE_LAST_UPDATE]
+        end = floor_to_step(end, step)
+        if start >= end:
+            return []
+
+        times = await self.hass.async_add_executor_job(
+            db.get_state_times, self.hass, self.entity_id, start, end
+        )
+        return find_gaps(times, start, end, step)
+
+    async def async_repair(
+        self,
+        start: datetime,
+        end: Optional[datetime] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+    ) -> None:
+        """Fetch and write only the ranges missing in the database.
+        Gaps are split in chunks of chunk_size points, fetched concurrently
+        and written in order as they arrive.
+        """
+
+        if self.historical.backfill and self.historical.backfill.is_active:
+            raise HomeAssistantError(
+                f"{self.entity_id}: a backfill is in progress"
+            )
+
+        if self.historical.repairing:
+            raise HomeAssistantError(
+                f"{self.entity_id}: a repair is already in progress"
+            )
+
+        self.historical.repairing = True
+        try:
+            gaps = await self.async_find_historical_gaps(start, end)
+            _LOGGER.debug(f"{self.entity_id}: {len(gaps)} gaps found")
+
+            step = self.historical_step
+            fetched = async_fetch_in_order(
+                self,
+                (
+                    chunk
+                    for (gap_start, gap_end) in gaps
+                    for chunk in split_range(
+                        gap_start, gap_end, step, chunk_size
+                    )
+                ),
+                step,
+                concurrency,
+            )
+            try:
+                async for _, log in fetched:
+                    await self.async_write_historical_chunk(log)
+
+            finally:
+                await fetched.aclose()
+
+        finally:
+            self.historical.repairing = False
+
+    async def async_export(
+        self,
+        start: datetime,
+        end: Optional[datetime] = None,
+        filename: Optional[str] = None,
+        format: str = FORMAT_PARQUET,
+    ) -> None:
+        """Export states between start and end (or now) to a columnar file in
+        the config directory.
+        """
+
+        config_dir = os.path.realpath(self.hass.config.config_dir)
+        path = os.path.realpath(
+            self.hass.config.path(filename or f"{self.entity_id}.{format}")
+        )
+        if os.path.commonpath([config_dir, path]) != config_dir:
+            raise HomeAssistantError(f"{path} is outside the config directory")
+
+        await self.hass.async_add_executor_job(
+            export_states,
+            self.hass,
+            self.entity_id,
+            dt_util.as_utc(start),
+            dt_util.as_utc(end or dt_util.utcnow()),
+            path,
+            format,
+        )
+
+    async def async_profile(self, cycles: int = DEFAULT_CYCLES) -> None:
+        """Profile the next update cycles (async_update and
+        flush_historical_log). Results are written to the config directory.
+        """
+
+        if self.historical.profiler:
+            raise HomeAssistantError(f"{self.entity_id} is already profiled")
+
+        now = dt_util.utcnow().strftime("%Y%m%d%H%M%S")
+        prefix = self.hass.config.path(f"{DOMAIN}-{self.entity_id}-{now}")
+        self.historical.profiler = Profiler(cycles, prefix)
+
+    async def _async_profiled_cycle_done(self, profiler: Profiler) -> None:
+        if not profiler.stop_cycle():
+            return
+
+        self.historical.profiler = None
+        files = await self.hass.async_add_executor_job(profiler.save)
+        _LOGGER.info(f"{self.entity_id} profile written to {files!r}")
+
+    def _stop_profiler(self) -> None:
+        if self.historical.profiler:
+            self.historical.profiler.close()
+            self.historical.profiler = None
+
+    def _stop_backfill(self) -> None:
+        if self.historical.backfill:
+            self.historical.backfill.stop()
+
     async def save_state(self, params):
         """Convenient function to store internal state"""
 
@@ -168,6 +559,7 @@ class HistoricalEntity:
         data = {
             STORE_LAST_STATE: None,
             STORE_LAST_UPDATE: 0,
+            STORE_BACKFILL: None,
         } | data
 
         data[STORE_LAST_UPDATE] = dt_util.as_utc(
@@ -198,21 +590,32 @@ class HistoricalEntity:
         state: str,
         dt: Optional[datetime],
         attributes: Optional[MappingProxyType] = None,
-    ):
+        index: bool = True,
+    ) -> str:
         """
         Wrapper for the modified version of
         homeassistant.core.StateMachine.async_set
+
+        Returns the state as written. If index is False the state is not
+        added to the in-memory index, the caller must do it.
         """
         state = _stringify_state(self, state)
+        if index:
+            self.historical.index.add(dt, state)
+
         attrs = dict(_build_attributes(self, state))
         attrs.update(attributes or {})
 
-        ret = async_set(
+        async_set(
             self.hass.states,
             entity_id=self.entity_id,
             new_state=state,
             attributes=attrs,
+            # Every historical point must be written, even if state and
+            # attributes are the same as the previous one (ex. with stable
+            # attributes)
+            force_update=True,
             time_fired=dt,
         )
 
-        return ret
+        return state
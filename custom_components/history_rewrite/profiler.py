@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from __future__ import annotations
+
+import cProfile
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+from types import FrameType
+from typing import Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CYCLES = 1
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+PACKAGE_DIR = os.path.dirname(__file__)
+RECORDER_THREAD_NAME = "Recorder"
+
+# Leaf frames of threads doing nothing
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+}
+
+
+class Profiler:
+    """Profile the next update cycles of an entity.
+
+    Two profiles are taken while a cycle is in progress:
+    - A deterministic one (cProfile) of the event loop thread, saved as
+      <prefix>.prof (pstats format)
+    - A sampling one of the event loop, the recorder and any executor thread
+      running code from this integration, saved as <prefix>.collapsed
+      (collapsed stacks, the input format of flamegraph.pl / speedscope)
+
+    Nothing runs until the first cycle starts.
+    """
+
+    def __init__(
+        self,
+        cycles: int,
+        prefix: str,
+        interval: float = DEFAULT_SAMPLE_INTERVAL,
+    ):
+        self.remaining = cycles
+        self.prefix = prefix
+        self.interval = interval
+
+        self._profile = cProfile.Profile()
+        self._stacks: collections.Counter[str] = collections.Counter()
+        self._sampling = threading.Event()
+        self._closed = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._loop_thread_id: Optional[int] = None
+
+    def start_cycle(self) -> None:
+        if self._sampler is None:
+            self._loop_thread_id = threading.get_ident()
+            self._sampler = threading.Thread(
+                target=self._sample,
+                name="history_rewrite_profiler",
+                daemon=True,
+            )
+            self._sampler.start()
+
+        self._sampling.set()
+        try:
+            self._profile.enable()
+        except ValueError:
+            _LOGGER.warning("Another profiler is active, only sampling")
+
+    def stop_cycle(self) -> bool:
+        """End a cycle. Returns True if there are no more cycles to profile"""
+
+        self._profile.disable()
+        self._sampling.clear()
+        self.remaining = self.remaining - 1
+
+        return self.remaining <= 0
+
+    def close(self) -> None:
+        self._sampling.clear()
+        self._closed.set()
+
+    def save(self) -> list[str]:
+        """Stop sampling and write profiles to disk. Blocking"""
+
+        self.close()
+        if self._sampler:
+            self._sampler.join()
+
+        prof = f"{self.prefix}.prof"
+        self._profile.dump_stats(prof)
+
+        collapsed = f"{self.prefix}.collapsed"
+        with open(collapsed, "w", encoding="utf-8") as fh:
+            for stack, count in sorted(self._stacks.items()):
+                fh.write(f"{stack} {count}\n")
+
+        return [prof, collapsed]
+
+    def _sample(self) -> None:
+        own_id = threading.get_ident()
+
+        while not self._closed.is_set():
+            if not self._sampling.wait(timeout=0.1):
+                continue
+
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                name = names.get(thread_id, str(thread_id))
+                if stack := self._collapse(
+                    frame,
+                    always=(
+                        thread_id == self._loop_thread_id
+                        or name == RECORDER_THREAD_NAME
+                    ),
+                ):
+                    self._stacks[f"{name};{stack}"] += 1
+
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _collapse(frame: FrameType, always: bool) -> Optional[str]:
+        """Collapsed stack (root first) of frame.
+        Idle stacks, and stacks without frames from this integration unless
+        always is True, are discarded.
+        """
+
+        code = frame.f_code
+        if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+            return None
+
+        ours = False
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            ours = ours or code.co_filename.startswith(PACKAGE_DIR)
+            stack.append(
+                f"{code.co_name} ({os.path.basename(code.co_filename)})"
+            )
+            frame = frame.f_back
+
+        if not (always or ours):
+            return None
+
+        return ";".join(reversed(stack))
@@ -18,6 +18,7 @@
 # USA.
 
 
+import logging
 from datetime import timedelta
 from typing import Optional
 
@@ -28,20 +29,56 @@ from homeassistant.components.sensor import (
     STATE_CLASS_TOTAL_INCREASING,
     SensorEntity,
 )
+import voluptuous as vol
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import DEVICE_CLASS_ENERGY, ENERGY_KILO_WATT_HOUR
+from homeassistant.const import (
+    DEVICE_CLASS_ENERGY,
+    ENERGY_KILO_WATT_HOUR,
+    ENTITY_CATEGORY_DIAGNOSTIC,
+    PERCENTAGE,
+)
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers import entity_platform
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.typing import DiscoveryInfoType
 from homeassistant.util import dt as dt_util
 
-from .const import DEFAULT_SENSOR_NAME, DOMAIN
-from .historical_state import HistoricalEntity
+from .backfill import DEFAULT_CHUNK_SIZE, DEFAULT_CONCURRENCY
+from .const import (
+    ATTR_CHUNK_SIZE,
+    ATTR_CONCURRENCY,
+    ATTR_CYCLES,
+    ATTR_END,
+    ATTR_FILENAME,
+    ATTR_FORMAT,
+    ATTR_INTERVAL,
+    ATTR_START,
+    CONF_STABLE_ATTRIBUTES,
+    DEFAULT_SENSOR_NAME,
+    DOMAIN,
+    SERVICE_BACKFILL,
+    SERVICE_BACKFILL_CANCEL,
+    SERVICE_BACKFILL_PAUSE,
+    SERVICE_BACKFILL_RESUME,
+    SERVICE_EXPORT,
+    SERVICE_PROFILE,
+    SERVICE_REPAIR,
+    SIGNAL_BACKFILL_UPDATED,
+)
+from .export import FORMAT_PARQUET, FORMATS
+from .historical_state import HistoricalEntity, floor_to_step
+from .profiler import DEFAULT_CYCLES
+
+_LOGGER = logging.getLogger(__name__)
+SLOW_API = False
 
 
 class MacFlySensor(HistoricalEntity, SensorEntity):
-    def __init__(self, name, api, unique_id):
+    def __init__(self, name, api, unique_id, stable_attributes=False):
         self._api = api
+        self._stable_attributes = stable_attributes
 
         self._attr_name = name
         self._attr_unique_id = unique_id
@@ -51,10 +88,15 @@ class MacFlySensor(HistoricalEntity, SensorEntity):
 
     @property
     def extra_state_attributes(self):
-        return {
+        attrs = {
             ATTR_LAST_RESET: self.last_reset,
             ATTR_STATE_CLASS: STATE_CLASS_MEASUREMENT,
         }
+        if self._stable_attributes:
+            # Each state covers [last_updated - interval, last_updated)
+            attrs[ATTR_INTERVAL] = int(self.historical_step.total_seconds())
+
+        return attrs
 
     @property
     def last_reset(self):
@@ -85,24 +127,22 @@ class MacFlySensor(HistoricalEntity, SensorEntity):
         # if state := self.historical_state():
         #     return float(state)
 
-    async def async_update(self):
-        # Query for the last day since the start of the current hour
-        slow_api = False
-
-        if slow_api:
-            step = timedelta(hours=1)
-            end = dt_util.now().replace(minute=0, second=0, microsecond=0)
-            start = end - timedelta(days=1)
+    @property
+    def historical_step(self):
+        return timedelta(hours=1) if SLOW_API else timedelta(seconds=120)
 
-        else:
-            now = dt_util.now()
-            step = timedelta(seconds=120)
-            end = now.replace(second=0, microsecond=0)
-            start = end - timedelta(minutes=60)
+    async def async_fetch_historical_log(self, start, end, step):
+        log = await self.hass.async_add_executor_job(
+            self._api.get_historical_data, start, end, step
+        )
 
         # Mangle API data
-        log = self._api.get_historical_data(start, end, step)
-        log = [
+        if self._stable_attributes:
+            # Keep the same attribute set for every state so the recorder can
+            # share it. The interval is derived from the state timestamp.
+            return [(dt_util.as_utc(end), v) for (start, end, v) in log]
+
+        return [
             (
                 dt_util.as_utc(end),
                 v,
@@ -111,11 +151,96 @@ class MacFlySensor(HistoricalEntity, SensorEntity):
             for (start, end, v) in log
         ]
 
+    async def async_update(self):
+        # Query for the last day since the start of the current hour
+        step = self.historical_step
+
+        # Align to the step grid so states are always written at the same
+        # points (required by async_repair)
+        end = floor_to_step(dt_util.now(), step)
+        if SLOW_API:
+            start = end - timedelta(days=1)
+
+        else:
+            start = end - timedelta(minutes=60)
+
+        log = await self.async_fetch_historical_log(start, end, step)
+
         self.extend_historical_log(log)
         if not self.should_poll:
             await self.flush_historical_log()
 
 
+class BackfillProgressSensor(SensorEntity):
+    """Diagnostic sensor with the progress of a HistoricalEntity backfill"""
+
+    _attr_entity_category = ENTITY_CATEGORY_DIAGNOSTIC
+    _attr_native_unit_of_measurement = PERCENTAGE
+    _attr_icon = "mdi:progress-clock"
+
+    def __init__(self, parent: HistoricalEntity):
+        self._parent = parent
+
+        self._attr_name = f"{parent.name} backfill"
+        self._attr_unique_id = f"{parent.unique_id}-backfill"
+
+    @property
+    def should_poll(self):
+        return False
+
+    async def async_added_to_hass(self) -> None:
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass,
+                SIGNAL_BACKFILL_UPDATED.format(self._parent.unique_id),
+                self.async_write_ha_state,
+            )
+        )
+
+    @property
+    def native_value(self):
+        if backfill := self._parent.historical.backfill:
+            return backfill.progress
+
+        return None
+
+    @property
+    def extra_state_attributes(self):
+        if not (backfill := self._parent.historical.backfill):
+            return {}
+
+        return {
+            "status": backfill.status,
+            "start": backfill.start,
+            "end": backfill.end,
+            "position": backfill.position,
+            "points_done": backfill.done,
+            "points_total": backfill.total,
+            "rate": backfill.rate,
+            "eta": backfill.eta,
+        }
+
+
+def _historical_entity_service(method):
+    """Entity service handler calling method on HistoricalEntities only.
+    Other entities of the platform (ex. BackfillProgressSensor) are skipped.
+    """
+
+    async def _handler(entity, call):
+        if not isinstance(entity, HistoricalEntity):
+            _LOGGER.debug(f"{entity.entity_id} is not an historical entity")
+            return
+
+        params = {
+            k: v
+            for (k, v) in call.data.items()
+            if k not in cv.ENTITY_SERVICE_FIELDS
+        }
+        await getattr(entity, method)(**params)
+
+    return _handler
+
+
 async def async_setup_entry(
     hass: HomeAssistant,
     config_entry: ConfigEntry,
@@ -123,12 +248,74 @@ async def async_setup_entry(
     discovery_info: Optional[DiscoveryInfoType] = None,
 ):
     api = hass.data[DOMAIN][config_entry.entry_id]
-    sensors = [
-        MacFlySensor(
-            api=api,
-            name=config_entry.data.get("name", DEFAULT_SENSOR_NAME),
-            unique_id=config_entry.entry_id,
-        )
-    ]
+    sensor = MacFlySensor(
+        api=api,
+        name=config_entry.data.get("name", DEFAULT_SENSOR_NAME),
+        unique_id=config_entry.entry_id,
+        stable_attributes=config_entry.options.get(
+            CONF_STABLE_ATTRIBUTES, False
+        ),
+    )
+    sensors = [sensor, BackfillProgressSensor(sensor)]
 
     add_entities(sensors, update_before_add=True)  # Update entity on add
+
+    platform = entity_platform.async_get_current_platform()
+    platform.async_register_entity_service(
+        SERVICE_BACKFILL,
+        {
+            vol.Required(ATTR_START): cv.datetime,
+            vol.Optional(ATTR_END): cv.datetime,
+            vol.Optional(
+                ATTR_CHUNK_SIZE, default=DEFAULT_CHUNK_SIZE
+            ): cv.positive_int,
+            vol.Optional(
+                ATTR_CONCURRENCY, default=DEFAULT_CONCURRENCY
+            ): cv.positive_int,
+        },
+        _historical_entity_service("async_backfill"),
+    )
+    platform.async_register_entity_service(
+        SERVICE_REPAIR,
+        {
+            vol.Required(ATTR_START): cv.datetime,
+            vol.Optional(ATTR_END): cv.datetime,
+            vol.Optional(
+                ATTR_CHUNK_SIZE, default=DEFAULT_CHUNK_SIZE
+            ): cv.positive_int,
+            vol.Optional(
+                ATTR_CONCURRENCY, default=DEFAULT_CONCURRENCY
+            ): cv.positive_int,
+        },
+        _historical_entity_service("async_repair"),
+    )
+    platform.async_register_entity_service(
+        SERVICE_EXPORT,
+        {
+            vol.Required(ATTR_START): cv.datetime,
+            vol.Optional(ATTR_END): cv.datetime,
+            vol.Optional(ATTR_FILENAME): cv.string,
+            vol.Optional(ATTR_FORMAT, default=FORMAT_PARQUET): vol.In(FORMATS),
+        },
+        _historical_entity_service("async_export"),
+    )
+    platform.async_register_entity_service(
+        SERVICE_PROFILE,
+        {vol.Optional(ATTR_CYCLES, default=DEFAULT_CYCLES): cv.positive_int},
+        _historical_entity_service("async_profile"),
+    )
+    platform.async_register_entity_service(
+        SERVICE_BACKFILL_PAUSE,
+        {},
+        _historical_entity_service("async_backfill_pause"),
+    )
+    platform.async_register_entity_service(
+        SERVICE_BACKFILL_RESUME,
+        {},
+        _historical_entity_service("async_backfill_resume"),
+    )
+    platform.async_register_entity_service(
+        SERVICE_BACKFILL_CANCEL,
+        {},
+        _historical_entity_service("async_backfill_cancel"),
+    )
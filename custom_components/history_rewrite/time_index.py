@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from datetime import datetime, timedelta
+from typing import Any, Iterable, Optional
+
+from homeassistant.util import dt as dt_util
+
+DEFAULT_RETENTION = timedelta(days=30)
+DEFAULT_MAX_POINTS = 100_000
+
+
+class TimeIndex:
+    """Bounded in-memory index of the numeric states of an entity.
+
+    Points are kept in two sorted arrays (times and values) plus a prefix
+    sum of the values, so "value at t" and "sum over [a, b)" are answered
+    with a couple of bisects.
+
+    Appending is O(1). Out of order points (ex. backfills) must be added in
+    batches with add_many, the prefix sum is rebuilt once per batch from
+    the oldest touched point.
+
+    The index is authoritative only from `since` onwards. Queries before
+    that point return None and must be answered by the database.
+    """
+
+    def __init__(
+        self,
+        retention: timedelta = DEFAULT_RETENTION,
+        max_points: int = DEFAULT_MAX_POINTS,
+    ):
+        self.retention = retention
+        self.max_points = max_points
+
+        self._times: list[float] = []
+        self._values: list[float] = []
+        # _prefix[i] - _prefix[j] == sum(_values[j:i])
+        self._prefix: list[float] = [0.0]
+        self._since: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._times)
+
+    @property
+    def since(self) -> Optional[datetime]:
+        if self._since is None:
+            return None
+
+        return dt_util.utc_from_timestamp(self._since)
+
+    def load(
+        self, since: datetime, points: Iterable[tuple[datetime, Any]]
+    ) -> None:
+        """(Re)build the index from an ordered set of points, ex. from the
+        recorder. The index will be authoritative from since onwards.
+        """
+        self._times = []
+        self._values = []
+        self._prefix = [0.0]
+        self._since = dt_util.as_utc(since).timestamp()
+
+        self.add_many(points)
+
+    def add(self, dt: datetime, value: Any) -> None:
+        """Add (or replace) a point. Non-numeric values are ignored"""
+
+        self.add_many([(dt, value)])
+
+    def add_many(self, points: Iterable[tuple[datetime, Any]]) -> None:
+        """Add (or replace) a batch of points. Non-numeric values are
+        ignored
+        """
+
+        if self._since is None:
+            return
+
+        dirty = None
+        for dt, value in points:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                continue
+
+            ts = dt_util.as_utc(dt).timestamp()
+            if ts < self._since:
+                continue
+
+            if not self._times or ts > self._times[-1]:
+                idx = len(self._times)
+                self._times.append(ts)
+                self._values.append(value)
+
+            else:
+                idx = bisect_left(self._times, ts)
+                if self._times[idx] == ts:
+                    self._values[idx] = value
+                else:
+                    self._times.insert(idx, ts)
+                    self._values.insert(idx, value)
+
+            dirty = idx if dirty is None else min(dirty, idx)
+
+        if dirty is None:
+            return
+
+        base = self._prefix[dirty]
+        del self._prefix[dirty:]
+        self._prefix.extend(accumulate(self._values[dirty:], initial=base))
+
+        self._trim()
+
+    def value_at(self, dt: datetime) -> Optional[tuple[datetime, float]]:
+        """Last point at or before dt, None if not covered by the index"""
+
+        idx = bisect_right(self._times, dt_util.as_utc(dt).timestamp()) - 1
+        if idx < 0:
+            return None
+
+        return dt_util.utc_from_timestamp(self._times[idx]), self._values[idx]
+
+    def sum(self, start: datetime, end: datetime) -> Optional[float]:
+        """Sum of values in [start, end), None if not covered by the index"""
+
+        start_ts = dt_util.as_utc(start).timestamp()
+        if self._since is None or start_ts < self._since:
+            return None
+
+        i = bisect_left(self._times, start_ts)
+        j = bisect_left(self._times, dt_util.as_utc(end).timestamp())
+        if j <= i:
+            return 0.0
+
+        return self._prefix[j] - self._prefix[i]
+
+    def _trim(self) -> None:
+        cutoff = (dt_util.utcnow() - self.retention).timestamp()
+
+        by_age = bisect_left(self._times, cutoff)
+        by_size = len(self._times) - self.max_points
+        if by_size > by_age:
+            # Everything before the first kept point is unknown now
+            drop, since = by_size, self._times[by_size]
+        else:
+            drop, since = by_age, cutoff
+
+        if drop > 0:
+            del self._times[:drop]
+            del self._values[:drop]
+            del self._prefix[:drop]
+
+        self._since = max(self._since, since)